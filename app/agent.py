@@ -1,39 +1,101 @@
 import os
+import re
 import json
-from typing import Optional, Dict, List, Tuple
+import functools
+from types import MappingProxyType
+from typing import AsyncIterator, Optional, Dict, List, Tuple
 from loguru import logger
 import dotenv
+import orjson
+
+from app.batcher import LLMBatcher
+from app.cache import normalize_message, response_cache
 
 dotenv.load_dotenv(dotenv_path="env")
 
+def _freeze(value):
+    """Deep read-only copy of a template table: dicts become mapping proxies, lists tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+_KA_RE = re.compile(r"[\u10A0-\u10FF]+")
+_RU_RE = re.compile(r"[\u0400-\u04FF]+")
+# Script detection only needs a short sample, not the whole message
+_LANG_SNIFF_CHARS = 64
+
+@functools.lru_cache(maxsize=4096)
+def _detect_lang_cached(sample: str) -> str:
+    ru_chars = sum(len(run) for run in _RU_RE.findall(sample))
+    if not ru_chars:
+        return "ka" if _KA_RE.search(sample) else "en"
+    ka_chars = sum(len(run) for run in _KA_RE.findall(sample))
+    if ka_chars > ru_chars:
+        return "ka"
+    return "ru"
+
 # Simple language "guess" – very naive, just for demo
 def detect_lang(text: str) -> str:
-    ka_chars = sum(ch >= "\u10A0" and ch <= "\u10FF" for ch in text)
-    ru_chars = sum("\u0400" <= ch <= "\u04FF" for ch in text)
-    if ka_chars > ru_chars and ka_chars > 0:
-        return "ka"
-    if ru_chars > 0:
-        return "ru"
-    return "en"
-
-def emergency_red_flags(text: str) -> Optional[str]:
-    flags = [
-        # EN
-        ("chest pain", "en"), ("shortness of breath", "en"), ("severe headache", "en"),
-        ("loss of consciousness", "en"), ("stroke", "en"), ("suicidal", "en"),
-        ("can't breathe", "en"), ("heart attack", "en"), ("severe bleeding", "en"),
-        # KA
-        ("მკერდის ტკივილი", "ka"), ("სუნთქვის უკმარისობა", "ka"), ("ძლიერი თავის ტკივილი", "ka"),
-        ("ბოდავს", "ka"), ("თვითმკვლელობა", "ka"), ("გულის შეტევა", "ka"),
-        # RU
-        ("боль в груди", "ru"), ("одышка", "ru"), ("сильная головная боль", "ru"),
-        ("потеря сознания", "ru"), ("инсульт", "ru"), ("суицид", "ru"), ("инфаркт", "ru"),
-    ]
-    lower = text.lower()
-    for kw, _ in flags:
-        if kw in lower:
-            return kw
-    return None
+    # Retries and follow-up endpoints re-send the same text, so memoize on the sample
+    return _detect_lang_cached(text[:_LANG_SNIFF_CHARS])
+
+def _compile_keywords(keywords: List[str]) -> re.Pattern:
+    # Keywords are lower-case and matched against lower-cased text; this is much
+    # faster than re.IGNORECASE, which disables the literal-prefix fast path
+    return re.compile("|".join(re.escape(kw) for kw in keywords))
+
+RED_FLAGS = [
+    # EN
+    ("chest pain", "en"), ("shortness of breath", "en"), ("severe headache", "en"),
+    ("loss of consciousness", "en"), ("stroke", "en"), ("suicidal", "en"),
+    ("can't breathe", "en"), ("heart attack", "en"), ("severe bleeding", "en"),
+    # KA
+    ("მკერდის ტკივილი", "ka"), ("სუნთქვის უკმარისობა", "ka"), ("ძლიერი თავის ტკივილი", "ka"),
+    ("ბოდავს", "ka"), ("თვითმკვლელობა", "ka"), ("გულის შეტევა", "ka"),
+    # RU
+    ("боль в груди", "ru"), ("одышка", "ru"), ("сильная головная боль", "ru"),
+    ("потеря сознания", "ru"), ("инсульт", "ru"), ("суицид", "ru"), ("инфаркт", "ru"),
+]
+
+# Compiled once at import; the regex engine walks the text in a single pass.
+# Every language's flags are always scanned: detect_lang only samples the start of
+# the message, and mixed-language messages must never miss a red flag.
+_RED_FLAG_RE = _compile_keywords([kw for kw, _ in RED_FLAGS])
+
+def emergency_red_flags(text: str, text_lower: Optional[str] = None) -> Optional[str]:
+    if text_lower is None:
+        text_lower = text.lower()
+    m = _RED_FLAG_RE.search(text_lower)
+    return m.group(0) if m else None
+
+_EMERGENCY_TEMPLATES = {
+    "ka": (
+        "თქვენი აღწერიდან არსებობს გადაუდებელი სიმპტომის რისკი ( მაგ., '{}').\n"
+        "გთხოვთ, დაუყოვნებლივ დარეკოთ 112‑ზე ან მიმართოთ უახლოეს გადაუდებელ განყოფილებას.\n"
+        "თუ შეგიძლიათ, თან წაიღეთ მიმდინარე მედიკამენტების სია და ალერგიების ინფორმაცია."
+    ),
+    "ru": (
+        "По описанию возможен признак неотложного состояния (напр., '{}').\n"
+        "Немедленно звоните 112 или обратитесь в ближайшее отделение неотложной помощи.\n"
+        "Если возможно, возьмите с собой список принимаемых препаратов и аллергий."
+    ),
+    "en": (
+        "Your description suggests a possible urgent symptom (e.g., '{}').\n"
+        "Please call **112** or go to the nearest emergency department **now**.\n"
+        "If you can, bring a list of your medications and allergies."
+    ),
+}
+
+EMERGENCY_SUGGESTED = _freeze({
+    "en": ["Call 112", "Go to emergency department", "Bring medication list"],
+    "ka": ["დარეკეთ 112‑ზე", "მიმართეთ გადაუდებელ განყოფილებას", "წაიღეთ მედიკამენტების სია"],
+    "ru": ["Позвоните 112", "Обратитесь в отделение неотложной помощи", "Возьмите список лекарств"],
+})
+
+def emergency_reply(flag: str, lang: str) -> str:
+    return _EMERGENCY_TEMPLATES.get(lang, _EMERGENCY_TEMPLATES["en"]).format(flag)
 
 # Disease-specific knowledge base
 DISEASE_GUIDELINES = {
@@ -113,176 +175,340 @@ AVOID:
 Remember: You cannot diagnose or prescribe. Guide users to appropriate care levels.
 """
 
-def analyze_symptoms(text: str, lang: str) -> Tuple[str, List[str], str]:
+LANG_INSTRUCTIONS = MappingProxyType({
+    "ka": "უპასუხე ქართულად. იყავი მეგობრული და მშვიდი. მოკლედ და გარკვევით.",
+    "ru": "Отвечай на русском языке. Будь дружелюбным и спокойным. Кратко и ясно.",
+    "en": "Respond in English. Be friendly and calm. Keep it brief and clear."
+})
+
+def _render_guidelines_reference() -> str:
+    """Render DISEASE_GUIDELINES as a static reference block for the system prompt"""
+    lines = ["CONDITION REFERENCE:"]
+    for condition, info in DISEASE_GUIDELINES.items():
+        lines.append(f"- {condition.replace('_', ' ').title()}")
+        lines.append(f"  Symptoms: {', '.join(info['symptoms'])}")
+        for lang, guidance in info["guidance"].items():
+            lines.append(f"  Guidance ({lang}): {guidance}")
+        lines.append(f"  Seek care if: {', '.join(info['red_flags'])}")
+    return "\n".join(lines)
+
+
+# Simple keyword matching for demo - could be enhanced with NLP
+SYMPTOM_KEYWORDS = {
+    "headache": ["headache", "head pain", "migraine", "თავის ტკივილი", "головная боль"],
+    "fever": ["fever", "hot", "temperature", "ცხელება", "лихорадка"],
+    "cough": ["cough", "coughing", "ხველა", "кашель"],
+    "cold": ["cold", "runny nose", "sneezing", "ცივი", "простуда"],
+    "stomach_pain": ["stomach", "belly", "abdominal", "nausea", "კუჭი", "живот", "тошнота"],
+}
+
+HIGH_URGENCY_KEYWORDS = ["severe", "intense", "can't", "unable", "emergency", "ძლიერი", "сильный"]
+
+_SYMPTOM_RES = {condition: _compile_keywords(kws) for condition, kws in SYMPTOM_KEYWORDS.items()}
+_HIGH_URGENCY_RE = _compile_keywords(HIGH_URGENCY_KEYWORDS)
+
+def analyze_symptoms(text: str, lang: str, text_lower: Optional[str] = None) -> Tuple[str, List[str], str]:
     """
     Analyze user input to extract symptoms and suggest relevant disease info
+    Pass `text_lower` when the caller already has the lower-cased text
     Returns: (primary_symptom, related_symptoms, urgency_level)
     """
-    # Simple keyword matching for demo - could be enhanced with NLP
-    symptom_keywords = {
-        "headache": ["headache", "head pain", "migraine", "თავის ტკივილი", "головная боль"],
-        "fever": ["fever", "hot", "temperature", "ცხელება", "лихорадка"],
-        "cough": ["cough", "coughing", "ხველა", "кашель"],
-        "cold": ["cold", "runny nose", "sneezing", "ცივი", "простуда"],
-        "stomach_pain": ["stomach", "belly", "abdominal", "nausea", "კუჭი", "живот", "тошнота"],
-    }
-    
-    text_lower = text.lower()
-    found_symptoms = []
-    
-    for condition, keywords in symptom_keywords.items():
-        if any(kw in text_lower for kw in keywords):
-            found_symptoms.append(condition)
+    if text_lower is None:
+        text_lower = text.lower()
+    found_symptoms = [
+        condition for condition, pattern in _SYMPTOM_RES.items() if pattern.search(text_lower)
+    ]
     
     primary_symptom = found_symptoms[0] if found_symptoms else "general"
     urgency_level = "low"
     
     # Check for high urgency keywords
-    high_urgency_keywords = ["severe", "intense", "can't", "unable", "emergency", "ძლიერი", "сильный"]
-    if any(kw in text_lower for kw in high_urgency_keywords):
+    if _HIGH_URGENCY_RE.search(text_lower):
         urgency_level = "moderate"
     
     return primary_symptom, found_symptoms, urgency_level
 
+# Symptom/condition name -> (condition, info), so guidance lookup is a single dict get
+_SYMPTOM_INDEX: Dict[str, Tuple[str, Dict]] = {}
+for _condition, _info in DISEASE_GUIDELINES.items():
+    for _symptom in _info["symptoms"]:
+        _SYMPTOM_INDEX.setdefault(_symptom, (_condition, _info))
+    _SYMPTOM_INDEX.setdefault(_condition, (_condition, _info))
+
 def get_disease_guidance(symptom: str, lang: str) -> Optional[Dict]:
     """Get specific guidance for a symptom/condition"""
-    for condition, info in DISEASE_GUIDELINES.items():
-        if symptom in info["symptoms"] or symptom == condition:
-            return {
-                "condition": condition,
-                "guidance": info["guidance"].get(lang, info["guidance"]["en"]),
-                "red_flags": info["red_flags"]
-            }
-    return None
+    hit = _SYMPTOM_INDEX.get(symptom)
+    if not hit:
+        return None
+    condition, info = hit
+    return {
+        "condition": condition,
+        "guidance": info["guidance"].get(lang, info["guidance"]["en"]),
+        "red_flags": list(info["red_flags"])
+    }
+
+# Read-only per-language templates, built once at import
+_FOLLOWUP_QUESTIONS = _freeze({
+    "headache": {
+        "en": ["How would you rate the pain on a scale of 1-10?"],
+        "ka": ["როგორ შეაფასებდით ტკივილს 1-10 შკალაზე?"],
+        "ru": ["Как бы вы оценили боль по шкале от 1 до 10?"]
+    },
+    "fever": {
+        "en": ["What's your current temperature?"],
+        "ka": ["რა არის თქვენი ახლანდელი ტემპერატურა?"],
+        "ru": ["Какая у вас сейчас температура?"]
+    },
+    "cough": {
+        "en": ["Is the cough dry or with phlegm?"],
+        "ka": ["ხველა მშრალია თუ გაქვთ ნახველი?"],
+        "ru": ["Кашель сухой или с мокротой?"]
+    },
+    "stomach_pain": {
+        "en": ["When did the stomach pain start?"],
+        "ka": ["როდის დაიწყო კუჭის ტკივილი?"],
+        "ru": ["Когда началась боль в животе?"]
+    }
+})
+
+_SUGGESTED_ACTIONS = _freeze({
+    "headache": {
+        "en": ["Rest in a quiet, dark room", "Stay hydrated", "Consider over-the-counter pain relief"],
+        "ka": ["დაისვენეთ მშვიდ, მუქ ოთახში", "დარჩით ჰიდრატებული", "განიხილეთ ტკივილგამათისებელი"],
+        "ru": ["Отдохните в тихой, темной комнате", "Пейте больше жидкости", "Рассмотрите безрецептурные обезболивающие"]
+    },
+    "fever": {
+        "en": ["Rest and stay hydrated", "Monitor temperature regularly", "Use fever reducers if needed"],
+        "ka": ["დაისვენეთ და დარჩით ჰიდრატებული", "რეგულარულად აკონტროლეთ ტემპერატურა", "საჭიროების შემთხვევაში გამოიყენეთ ცხელების შემამცირებელი"],
+        "ru": ["Отдыхайте и пейте много жидкости", "Регулярно измеряйте температуру", "При необходимости используйте жаропонижающие"]
+    },
+    "stomach_pain": {
+        "en": ["Eat light foods", "Stay hydrated with clear fluids", "Rest and avoid heavy meals"],
+        "ka": ["მიირთვით მსუბუქი საკვები", "დარჩით ჰიდრატებული გამჭვირვალე სითხეებით", "დაისვენეთ და ავარიდეთ მძიმე საკვები"],
+        "ru": ["Ешьте легкую пищу", "Пейте прозрачные жидкости", "Отдыхайте и избегайте тяжелой пищи"]
+    }
+})
+
+_DEFAULT_ACTIONS = _freeze({
+    "en": ["Monitor symptoms", "Rest and stay hydrated", "Seek medical care if worsening"],
+    "ka": ["დააკვირდით სიმპტომებს", "დაისვენეთ და დარჩით ჰიდრატებული", "მიმართეთ ექიმს თუ უარესდება"],
+    "ru": ["Следите за симптомами", "Отдыхайте и пейте жидкость", "Обратитесь к врачу при ухудшении"]
+})
 
 def generate_follow_up_questions(symptom: str, lang: str) -> List[str]:
     """Generate relevant follow-up questions based on symptom"""
-    questions = {
-        "headache": {
-            "en": ["How would you rate the pain on a scale of 1-10?"],
-            "ka": ["როგორ შეაფასებდით ტკივილს 1-10 შკალაზე?"],
-            "ru": ["Как бы вы оценили боль по шкале от 1 до 10?"]
-        },
-        "fever": {
-            "en": ["What's your current temperature?"],
-            "ka": ["რა არის თქვენი ახლანდელი ტემპერატურა?"],
-            "ru": ["Какая у вас сейчас температура?"]
-        },
-        "cough": {
-            "en": ["Is the cough dry or with phlegm?"],
-            "ka": ["ხველა მშრალია თუ გაქვთ ნახველი?"],
-            "ru": ["Кашель сухой или с мокротой?"]
-        },
-        "stomach_pain": {
-            "en": ["When did the stomach pain start?"],
-            "ka": ["როდის დაიწყო კუჭის ტკივილი?"],
-            "ru": ["Когда началась боль в животе?"]
-        }
-    }
-    
-    return questions.get(symptom, {}).get(lang, questions.get(symptom, {}).get("en", []))
+    by_lang = _FOLLOWUP_QUESTIONS.get(symptom, {})
+    return list(by_lang.get(lang, by_lang.get("en", ())))
 
 def generate_suggested_actions(symptom: str, urgency_level: str, lang: str) -> List[str]:
     """Generate actionable suggestions based on symptom and urgency"""
-    actions = {
-        "headache": {
-            "en": ["Rest in a quiet, dark room", "Stay hydrated", "Consider over-the-counter pain relief"],
-            "ka": ["დაისვენეთ მშვიდ, მუქ ოთახში", "დარჩით ჰიდრატებული", "განიხილეთ ტკივილგამათისებელი"],
-            "ru": ["Отдохните в тихой, темной комнате", "Пейте больше жидкости", "Рассмотрите безрецептурные обезболивающие"]
-        },
-        "fever": {
-            "en": ["Rest and stay hydrated", "Monitor temperature regularly", "Use fever reducers if needed"],
-            "ka": ["დაისვენეთ და დარჩით ჰიდრატებული", "რეგულარულად აკონტროლეთ ტემპერატურა", "საჭიროების შემთხვევაში გამოიყენეთ ცხელების შემამცირებელი"],
-            "ru": ["Отдыхайте и пейте много жидкости", "Регулярно измеряйте температуру", "При необходимости используйте жаропонижающие"]
-        },
-        "stomach_pain": {
-            "en": ["Eat light foods", "Stay hydrated with clear fluids", "Rest and avoid heavy meals"],
-            "ka": ["მიირთვით მსუბუქი საკვები", "დარჩით ჰიდრატებული გამჭვირვალე სითხეებით", "დაისვენეთ და ავარიდეთ მძიმე საკვები"],
-            "ru": ["Ешьте легкую пищу", "Пейте прозрачные жидкости", "Отдыхайте и избегайте тяжелой пищи"]
-        }
-    }
+    return list(_SUGGESTED_ACTIONS.get(symptom, {}).get(lang, _DEFAULT_ACTIONS.get(lang, _DEFAULT_ACTIONS["en"])))
+
+def _render_triage_reference() -> str:
+    """Render red flags, follow-up questions and self-care actions for the system prompt"""
+    lines = ["EMERGENCY RED FLAGS (tell the user to call 112 immediately if mentioned):"]
+    for lang in LANG_INSTRUCTIONS:
+        lines.append(f"- ({lang}) {', '.join(kw for kw, kw_lang in RED_FLAGS if kw_lang == lang)}")
+    lines.append("")
+    lines.append("PREFERRED FOLLOW-UP QUESTION PER SYMPTOM (ask only one):")
+    for symptom, by_lang in _FOLLOWUP_QUESTIONS.items():
+        lines.append(f"- {symptom.replace('_', ' ')}: " + " / ".join(q for qs in by_lang.values() for q in qs))
+    lines.append("")
+    lines.append("SELF-CARE ACTIONS PER SYMPTOM:")
+    for symptom, by_lang in (*_SUGGESTED_ACTIONS.items(), ("anything else", _DEFAULT_ACTIONS)):
+        for lang, actions in by_lang.items():
+            lines.append(f"- {symptom.replace('_', ' ')} ({lang}): {'; '.join(actions)}")
+    return "\n".join(lines)
+
+# One fully static system message per language. OpenAI caches prompt prefixes of
+# 1024+ tokens, so this must stay byte-identical across requests and come first.
+# Measured with tiktoken o200k_base: 1451 (en), 1458 (ka), 1459 (ru) tokens. Re-measure
+# when editing the prompt or reference tables; without the triage reference it was ~775.
+STATIC_SYSTEM_PROMPTS = MappingProxyType({
+    lang: f"{IMPROVED_SYSTEM_PROMPT}\n{_render_guidelines_reference()}\n\n{_render_triage_reference()}\n\n{instruction}"
+    for lang, instruction in LANG_INSTRUCTIONS.items()
+})
+
+# ---- OpenAI client (lazy import so app starts without key in dev) ----
+_client = None
+
+def get_client():
+    """Return a shared OpenAI client so its connection pool is reused across requests"""
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+def render_context(conversation_context: Optional[Dict]) -> Optional[str]:
+    """Canonical JSON for the context, so equal dicts always render to the same string"""
+    if not conversation_context:
+        return None
+    try:
+        return orjson.dumps(conversation_context, option=orjson.OPT_SORT_KEYS).decode()
+    except orjson.JSONEncodeError:
+        # orjson rejects e.g. integers wider than 64 bits; stdlib json handles them
+        return json.dumps(conversation_context, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+def build_query_messages(prompt_user: str, disease_info: Optional[Dict], context_json: Optional[str] = None) -> List[Dict]:
+    """Per-request messages that follow the static system prompt"""
+    messages = []
     
-    default_actions = {
-        "en": ["Monitor symptoms", "Rest and stay hydrated", "Seek medical care if worsening"],
-        "ka": ["დააკვირდით სიმპტომებს", "დაისვენეთ და დარჩით ჰიდრატებული", "მიმართეთ ექიმს თუ უარესდება"],
-        "ru": ["Следите за симптомами", "Отдыхайте и пейте жидкость", "Обратитесь к врачу при ухудшении"]
-    }
+    # Add disease-specific guidance if found
+    if disease_info:
+        guidance_msg = f"Relevant condition guidance: {disease_info['guidance']}"
+        messages.append({"role": "system", "content": guidance_msg})
     
-    return actions.get(symptom, {}).get(lang, default_actions.get(lang, default_actions["en"]))
+    # Add conversation context if available
+    if context_json:
+        context_msg = f"Previous context: {context_json}"
+        messages.append({"role": "user", "content": context_msg})
+
+    messages.append({"role": "user", "content": prompt_user})
+    return messages
+
+async def _complete(model: str, messages: List[Dict], max_tokens: int, response_format: Optional[Dict] = None) -> str:
+    client = get_client()
+    extra = {"response_format": response_format} if response_format else {}
+    resp = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.2,  # Lower temperature for more consistent medical responses
+        max_tokens=max_tokens,
+        **extra,
+    )
+    return resp.choices[0].message.content.strip()
+
+# Opt-in: batching sends several users' queries in one prompt, so call_llm only
+# batches requests without user context (no one's personal details are shared)
+_batcher = None
+if os.getenv("LLM_BATCHING", "0") == "1":
+    _batcher = LLMBatcher(
+        _complete,
+        max_batch=int(os.getenv("LLM_BATCH_SIZE", "8")),
+        window=int(os.getenv("LLM_BATCH_WINDOW_MS", "250")) / 1000,
+    )
+
+def reply_max_tokens(urgency_level: str) -> int:
+    """Low-urgency triage only needs a short answer; less generation means a faster reply"""
+    return 150 if urgency_level == "low" else 300
+
+def _prepare(prompt_user: str, prompt_lower: str, lang: str, context_json: Optional[str]) -> Tuple[str, str, Optional[Dict], str, List[Dict]]:
+    """Analyze the message and build the prompt: (symptom, urgency, disease_info, system_prompt, messages)"""
+    primary_symptom, related_symptoms, urgency_level = analyze_symptoms(prompt_user, lang, prompt_lower)
+    disease_info = get_disease_guidance(primary_symptom, lang)
+    
+    # Static content first so OpenAI's prompt cache can reuse the prefix,
+    # per-request content (guidance, context) strictly after it
+    system_prompt = STATIC_SYSTEM_PROMPTS.get(lang, STATIC_SYSTEM_PROMPTS["en"])
+    messages = build_query_messages(prompt_user, disease_info, context_json)
+    return primary_symptom, urgency_level, disease_info, system_prompt, messages
+
+def _build_result(reply: str, primary_symptom: str, urgency_level: str, lang: str, disease_info: Optional[Dict]) -> Dict:
+    # Generate follow-up questions based on symptom
+    follow_up_questions = generate_follow_up_questions(primary_symptom, lang)
+    
+    # Generate suggested actions
+    suggested_actions = generate_suggested_actions(primary_symptom, urgency_level, lang)
+    
+    return {
+        "reply": reply,
+        "follow_up_questions": follow_up_questions[:1],  # Only one question at a time
+        "suggested_actions": suggested_actions,
+        "urgency_level": urgency_level,
+        "disease_info": disease_info
+    }
+
+# Fallback generic response
+_FALLBACK_RESPONSES = MappingProxyType({
+    "ka": "ვწუხვარ, პასუხის გენერაცია ვერ გამოვიდა. სცადეთ მოგვიანებით.\nამასობაში, თუ სიმპტომები მძიმდება, დაეკონტაქტეთ 112‑ს.",
+    "ru": "Извините, не удалось получить ответ. Попробуйте позже.\nЕсли состояние ухудшается — звоните 112.",
+    "en": "Sorry, I couldn't generate a response right now. Please try again later.\nIf symptoms worsen, call emergency services."
+})
+
+def _fallback_result(lang: str) -> Dict:
+    return {
+        "reply": _FALLBACK_RESPONSES.get(lang, _FALLBACK_RESPONSES["en"]),
+        "follow_up_questions": [],
+        "suggested_actions": [],
+        "urgency_level": "low",
+        "disease_info": None
+    }
+
+async def call_llm(prompt_user: str, model: str, lang: str, conversation_context: Optional[Dict] = None, prompt_lower: Optional[str] = None) -> Dict:
+    if prompt_lower is None:
+        prompt_lower = prompt_user.lower()
+    context_json = render_context(conversation_context)
+
+    # Identical questions with identical context get the same answer, so skip the LLM round-trip
+    cache_key = (lang, model, normalize_message(prompt_lower), context_json)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-# ---- OpenAI client (lazy import so app starts without key in dev) ----
-def call_llm(prompt_user: str, model: str, lang: str, conversation_context: Optional[Dict] = None) -> Dict:
-    print(os.getenv("OPENAI_API_KEY"))
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        # Analyze symptoms first
-        primary_symptom, related_symptoms, urgency_level = analyze_symptoms(prompt_user, lang)
-        disease_info = get_disease_guidance(primary_symptom, lang)
-        
-        # Enhanced system prompt with conversation context
-        messages = [
-            {"role": "system", "content": IMPROVED_SYSTEM_PROMPT},
-        ]
-
-        # Add language-specific instructions
-        lang_instructions = {
-            "ka": "უპასუხე ქართულად. იყავი მეგობრული და მშვიდი. მოკლედ და გარკვევით.",
-            "ru": "Отвечай на русском языке. Будь дружелюбным и спокойным. Кратко и ясно.",
-            "en": "Respond in English. Be friendly and calm. Keep it brief and clear."
-        }
-        
-        messages.append({"role": "system", "content": lang_instructions.get(lang, lang_instructions["en"])})
+        primary_symptom, urgency_level, disease_info, system_prompt, messages = _prepare(prompt_user, prompt_lower, lang, context_json)
+
+        max_tokens = reply_max_tokens(urgency_level)
+        if _batcher is not None and context_json is None:
+            response_text = await _batcher.submit(model, system_prompt, messages, max_tokens)
+        else:
+            response_text = await _complete(
+                model, [{"role": "system", "content": system_prompt}, *messages], max_tokens
+            )
         
-        # Add conversation context if available
-        if conversation_context:
-            context_msg = f"Previous context: {json.dumps(conversation_context, ensure_ascii=False)}"
-            messages.append({"role": "system", "content": context_msg})
+        result = _build_result(response_text, primary_symptom, urgency_level, lang, disease_info)
+        response_cache.set(cache_key, result)
+        return result
         
-        # Add disease-specific guidance if found
-        if disease_info:
-            guidance_msg = f"Relevant condition guidance: {disease_info['guidance']}"
-            messages.append({"role": "system", "content": guidance_msg})
+    except Exception as e:
+        logger.exception("LLM error")
+        return _fallback_result(lang)
 
-        messages.append({"role": "user", "content": prompt_user})
+async def stream_llm(prompt_user: str, model: str, lang: str, conversation_context: Optional[Dict] = None, prompt_lower: Optional[str] = None) -> AsyncIterator[Dict]:
+    """
+    Streaming variant of call_llm. Yields {"delta": text} events as tokens arrive,
+    then one final event with the remaining ChatResponse fields and "done": True.
+    """
+    parts = []
+    try:
+        if prompt_lower is None:
+            prompt_lower = prompt_user.lower()
+        context_json = render_context(conversation_context)
+        cache_key = (lang, model, normalize_message(prompt_lower), context_json)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield {"delta": cached.pop("reply")}
+            yield {**cached, "done": True}
+            return
 
-        resp = client.chat.completions.create(
+        primary_symptom, urgency_level, disease_info, system_prompt, messages = _prepare(prompt_user, prompt_lower, lang, context_json)
+        stream = await get_client().chat.completions.create(
             model=model,
-            messages=messages,
-            temperature=0.2,  # Lower temperature for more consistent medical responses
-            max_tokens=300,   # Reduced to encourage concise responses
+            messages=[{"role": "system", "content": system_prompt}, *messages],
+            temperature=0.2,
+            max_tokens=reply_max_tokens(urgency_level),
+            stream=True,
         )
-        
-        response_text = resp.choices[0].message.content.strip()
-        
-        # Generate follow-up questions based on symptom
-        follow_up_questions = generate_follow_up_questions(primary_symptom, lang)
-        
-        # Generate suggested actions
-        suggested_actions = generate_suggested_actions(primary_symptom, urgency_level, lang)
-        
-        return {
-            "reply": response_text,
-            "follow_up_questions": follow_up_questions[:1],  # Only one question at a time
-            "suggested_actions": suggested_actions,
-            "urgency_level": urgency_level,
-            "disease_info": disease_info
-        }
-        
+        # Close the stream even if the client disconnects mid-reply, so the upstream
+        # generation stops and the connection returns to the pool
+        async with stream:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield {"delta": delta}
+
+        result = _build_result("".join(parts).strip(), primary_symptom, urgency_level, lang, disease_info)
+        response_cache.set(cache_key, result)
     except Exception as e:
-        logger.exception("LLM error")
-        # Fallback generic response
-        fallback_responses = {
-            "ka": "ვწუხვარ, პასუხის გენერაცია ვერ გამოვიდა. სცადეთ მოგვიანებით.\nამასობაში, თუ სიმპტომები მძიმდება, დაეკონტაქტეთ 112‑ს.",
-            "ru": "Извините, не удалось получить ответ. Попробуйте позже.\nЕсли состояние ухудшается — звоните 112.",
-            "en": "Sorry, I couldn't generate a response right now. Please try again later.\nIf symptoms worsen, call emergency services."
-        }
-        
-        return {
-            "reply": fallback_responses.get(lang, fallback_responses["en"]),
-            "follow_up_questions": [],
-            "suggested_actions": [],
-            "urgency_level": "low",
-            "disease_info": None
-        }
+        logger.exception("LLM stream error")
+        fallback = _fallback_result(lang)
+        # Start the fallback on its own line if part of a reply was already sent
+        yield {"delta": ("\n\n" if parts else "") + fallback.pop("reply")}
+        yield {**fallback, "done": True}
+        return
+
+    yield {**{k: v for k, v in result.items() if k != "reply"}, "done": True}
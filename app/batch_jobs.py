@@ -0,0 +1,150 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+from app.agent import (
+    STATIC_SYSTEM_PROMPTS,
+    analyze_symptoms,
+    build_query_messages,
+    detect_lang,
+    emergency_red_flags,
+    emergency_reply,
+    get_client,
+    get_disease_guidance,
+    reply_max_tokens,
+)
+
+# Offline/bulk triage goes through the Batch API: ~50% cheaper, results within 24h
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# Tags batches created here, so get_batch won't serve other jobs on the same OpenAI account
+BATCH_SOURCE = "aiclinic-chat-bulk"
+
+def _custom_id(index: int, user_id: str) -> str:
+    return f"{index}:{user_id}"
+
+def _user_id(custom_id: str) -> str:
+    return custom_id.split(":", 1)[1]
+
+def build_batch_jsonl(items: List[Tuple[int, str, str, Optional[str]]], model: str) -> bytes:
+    """Render (index, user_id, message, lang) items as Batch API chat.completions requests"""
+    lines = []
+    for index, user_id, message, lang in items:
+        lang = lang or detect_lang(message)
+        primary_symptom, _, urgency_level = analyze_symptoms(message, lang)
+        disease_info = get_disease_guidance(primary_symptom, lang)
+        messages = [
+            {"role": "system", "content": STATIC_SYSTEM_PROMPTS.get(lang, STATIC_SYSTEM_PROMPTS["en"])},
+            *build_query_messages(message, disease_info),
+        ]
+        lines.append(orjson.dumps({
+            "custom_id": _custom_id(index, user_id),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": model,
+                "messages": messages,
+                "temperature": 0.2,
+                "max_tokens": reply_max_tokens(urgency_level),
+            },
+        }))
+    return b"\n".join(lines) + b"\n"
+
+def split_emergencies(items: List[Tuple[str, str, Optional[str]]]) -> Tuple[List[Dict], List[Tuple[int, str, str, Optional[str]]]]:
+    """
+    Answer red-flag items right away with the emergency reply, as /api/chat does,
+    instead of queueing them for up to 24h. Returns (emergency results, items to queue);
+    both keep each item's position in the submitted list as its index.
+    """
+    emergencies, queued = [], []
+    for index, (user_id, message, lang) in enumerate(items):
+        flag = emergency_red_flags(message)
+        if flag:
+            lang = lang or detect_lang(message)
+            emergencies.append({
+                "index": index,
+                "user_id": user_id,
+                "reply": emergency_reply(flag, lang),
+                "urgency_level": "emergency",
+                "error": None,
+            })
+        else:
+            queued.append((index, user_id, message, lang))
+    return emergencies, queued
+
+async def submit_batch(items: List[Tuple[str, str, Optional[str]]], model: str) -> Dict:
+    """
+    Upload the requests file and create a batch job; returns its id and status.
+    Red-flag items are never queued: they come back immediately under "emergencies".
+    """
+    emergencies, queued = split_emergencies(items)
+    if not queued:
+        return {"batch_id": None, "status": "completed", "results": [], "emergencies": emergencies}
+
+    client = get_client()
+    upload = await client.files.create(
+        file=("chat_bulk.jsonl", build_batch_jsonl(queued, model)),
+        purpose="batch",
+    )
+    batch = await client.batches.create(
+        input_file_id=upload.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata={"source": BATCH_SOURCE},
+    )
+    return {"batch_id": batch.id, "status": batch.status, "results": None, "emergencies": emergencies}
+
+def _parse_output(text: str) -> List[Dict]:
+    results = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        index = int(record["custom_id"].split(":", 1)[0])
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            error = record.get("error") or body.get("error")
+            results.append({"index": index, "user_id": _user_id(record["custom_id"]), "reply": None, "error": error})
+            continue
+        choices = body.get("choices") or [{}]
+        content = (choices[0].get("message") or {}).get("content")
+        if not content:
+            # e.g. a refusal, which comes back with null content
+            error = {"message": "Completion returned no content"}
+            results.append({"index": index, "user_id": _user_id(record["custom_id"]), "reply": None, "error": error})
+            continue
+        results.append({"index": index, "user_id": _user_id(record["custom_id"]), "reply": content.strip(), "error": None})
+    return results
+
+async def get_batch(batch_id: str) -> Optional[Dict]:
+    """Fetch batch status, plus per-item results once the job has finished; None if not ours"""
+    client = get_client()
+    batch = await client.batches.retrieve(batch_id)
+    if (batch.metadata or {}).get("source") != BATCH_SOURCE:
+        return None
+    job = {"batch_id": batch.id, "status": batch.status, "results": None}
+    if batch.status != "completed":
+        return job
+
+    results = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            content = await client.files.content(file_id)
+            results.extend(_parse_output(content.text))
+    results.sort(key=lambda r: r["index"])
+    job["results"] = results
+    return job
+
+async def run_batch(items: List[Tuple[str, str, Optional[str]]], model: str, poll_interval: float = 60.0) -> Dict:
+    """Submit a batch and poll until it reaches a terminal state (for scripts/admin jobs)"""
+    job = await submit_batch(items, model)
+    emergencies = job["emergencies"]
+    if job["batch_id"] is None:
+        return job
+    while True:
+        job = await get_batch(job["batch_id"])
+        if job["status"] in ("completed", "failed", "expired", "cancelled"):
+            return {**job, "emergencies": emergencies}
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,36 @@
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+_WS_RE = re.compile(r"\s+")
+
+def normalize_message(text_lower: str) -> str:
+    """Collapse whitespace in a lower-cased message so trivially different messages share a cache entry"""
+    return _WS_RE.sub(" ", text_lower.strip())
+
+class ResponseCache:
+    """Small in-process LRU of chat responses keyed on (lang, model, normalized message, context)"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Dict]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        value = self._data.get(key)
+        if value is None:
+            return None
+        self._data.move_to_end(key)
+        # Hand out a copy so callers can't mutate the cached entry
+        return dict(value)
+
+    def set(self, key: Hashable, value: Dict) -> None:
+        self._data[key] = dict(value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+response_cache = ResponseCache(maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")))
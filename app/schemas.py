@@ -19,3 +19,24 @@ class SymptomAssessment(BaseModel):
     duration: str
     triggers: Optional[List[str]] = None
     associated_symptoms: Optional[List[str]] = None
+
+class BulkChatItem(BaseModel):
+    user_id: str
+    message: str
+    lang: Optional[str] = None  # "en", "ka", "ru"; detected from the message if omitted
+
+class BulkChatRequest(BaseModel):
+    items: List[BulkChatItem]
+
+class BulkChatResult(BaseModel):
+    index: int  # position of the item in the submitted BulkChatRequest.items
+    user_id: str
+    reply: Optional[str] = None
+    urgency_level: Optional[str] = None  # "emergency" for red-flag items answered without the LLM
+    error: Optional[dict] = None
+
+class BulkChatJob(BaseModel):
+    batch_id: Optional[str] = None  # None when every item was answered as an emergency
+    status: str  # OpenAI batch status: "validating", "in_progress", "completed", ...
+    results: Optional[List[BulkChatResult]] = None
+    emergencies: Optional[List[BulkChatResult]] = None  # only returned on submit
@@ -1,14 +1,31 @@
 import os
-from fastapi import FastAPI, HTTPException
+import hashlib
+import hmac
+from typing import Optional
+import orjson
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from loguru import logger
-from app.schemas import ChatRequest, ChatResponse, SymptomAssessment, SymptomAssessment
-from app.agent import detect_lang, emergency_red_flags, call_llm, get_disease_guidance, generate_suggested_actions
+from app.schemas import ChatRequest, ChatResponse, SymptomAssessment, BulkChatRequest, BulkChatJob
+from app.agent import (
+    DISEASE_GUIDELINES,
+    LANG_INSTRUCTIONS,
+    detect_lang,
+    EMERGENCY_SUGGESTED,
+    emergency_red_flags,
+    emergency_reply,
+    call_llm,
+    stream_llm,
+    get_disease_guidance,
+    generate_suggested_actions,
+)
+from app.batch_jobs import submit_batch, get_batch
 
 load_dotenv(dotenv_path=".env")
 
-app = FastAPI(title="AIClinic Backend", version="0.1.0")
+app = FastAPI(title="AIClinic Backend", version="0.1.0", default_response_class=ORJSONResponse)
 
 origins_env = os.getenv("ALLOWED_ORIGINS", "")
 if origins_env:
@@ -23,46 +40,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Guideline payloads are static per (condition, lang): serialize them once at startup
+_GUIDELINE_CACHE = {}
+_GUIDELINE_ETAG = {}
+for _condition, _guidelines in DISEASE_GUIDELINES.items():
+    for _lang in LANG_INSTRUCTIONS:
+        _body = orjson.dumps({
+            "condition": _condition,
+            "guidance": _guidelines["guidance"].get(_lang, _guidelines["guidance"]["en"]),
+            "red_flags": _guidelines["red_flags"],
+            "symptoms": _guidelines["symptoms"]
+        })
+        _GUIDELINE_CACHE[(_condition, _lang)] = _body
+        _GUIDELINE_ETAG[(_condition, _lang)] = f'"{hashlib.sha1(_body).hexdigest()}"'
+
 @app.get("/health")
 def health():
-    print(os.getenv("OPENAI_API_KEY"))  # for debugging
     return {"ok": True}
 
+def emergency_response(flag: str, lang: str) -> ChatResponse:
+    return ChatResponse(
+        reply=emergency_reply(flag, lang),
+        urgency_level="emergency",
+        suggested_actions=list(EMERGENCY_SUGGESTED.get(lang, EMERGENCY_SUGGESTED["en"]))
+    )
+
 @app.post("/api/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     user_text = (req.message or "").strip()
     if not user_text:
         raise HTTPException(status_code=400, detail="Empty message")
 
+    # Lower-case once; red flags, symptom analysis and the cache key all reuse it
+    user_lower = user_text.lower()
     lang = detect_lang(user_text)
-    flag = emergency_red_flags(user_text)
+    flag = emergency_red_flags(user_text, user_lower)
     if flag:
-        if lang == "ka":
-            reply = (
-                "თქვენი აღწერიდან არსებობს გადაუდებელი სიმპტომის რისკი ( მაგ., '{}').\n"
-                "გთხოვთ, დაუყოვნებლივ დარეკოთ 112‑ზე ან მიმართოთ უახლოეს გადაუდებელ განყოფილებას.\n"
-                "თუ შეგიძლიათ, თან წაიღეთ მიმდინარე მედიკამენტების სია და ალერგიების ინფორმაცია."
-            ).format(flag)
-        elif lang == "ru":
-            reply = (
-                "По описанию возможен признак неотложного состояния (напр., '{}').\n"
-                "Немедленно звоните 112 или обратитесь в ближайшее отделение неотложной помощи.\n"
-                "Если возможно, возьмите с собой список принимаемых препаратов и аллергий."
-            ).format(flag)
-        else:
-            reply = (
-                "Your description suggests a possible urgent symptom (e.g., '{}').\n"
-                "Please call **112** or go to the nearest emergency department **now**.\n"
-                "If you can, bring a list of your medications and allergies."
-            ).format(flag)
-        return ChatResponse(
-            reply=reply,
-            urgency_level="emergency",
-            suggested_actions=["Call 112", "Go to emergency department", "Bring medication list"]
-        )
+        return emergency_response(flag, lang)
 
     model = os.getenv("MODEL_NAME", "gpt-4o")
-    response_data = call_llm(user_text, model=model, lang=lang, conversation_context=req.user_context)
+    response_data = await call_llm(
+        user_text, model=model, lang=lang, conversation_context=req.user_context, prompt_lower=user_lower
+    )
     
     return ChatResponse(
         reply=response_data["reply"],
@@ -72,13 +91,84 @@ def chat(req: ChatRequest):
         disease_info=response_data.get("disease_info")
     )
 
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """Server-sent events version of /api/chat: reply text as it is generated, then the rest"""
+    user_text = (req.message or "").strip()
+    if not user_text:
+        raise HTTPException(status_code=400, detail="Empty message")
+
+    user_lower = user_text.lower()
+    lang = detect_lang(user_text)
+    flag = emergency_red_flags(user_text, user_lower)
+    model = os.getenv("MODEL_NAME", "gpt-4o")
+
+    async def events():
+        if flag:
+            emergency = emergency_response(flag, lang).model_dump()
+            yield {"delta": emergency.pop("reply")}
+            yield {**emergency, "done": True}
+            return
+        async for event in stream_llm(
+            user_text, model=model, lang=lang, conversation_context=req.user_context, prompt_lower=user_lower
+        ):
+            yield event
+
+    async def sse():
+        async for event in events():
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream")
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """Bulk endpoints read other users' replies, so they need ADMIN_TOKEN; unset disables them"""
+    admin_token = os.getenv("ADMIN_TOKEN", "")
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/api/chat/bulk", response_model=BulkChatJob, dependencies=[Depends(require_admin)])
+async def chat_bulk(req: BulkChatRequest):
+    """Queue non-interactive chats through the OpenAI Batch API (results within 24h)"""
+    min_items = int(os.getenv("BULK_MIN_ITEMS", "10"))
+    if len(req.items) < min_items:
+        raise HTTPException(status_code=400, detail=f"Bulk requests need at least {min_items} items; use /api/chat instead")
+    max_items = int(os.getenv("BULK_MAX_ITEMS", "1000"))
+    if len(req.items) > max_items:
+        raise HTTPException(status_code=413, detail=f"Bulk requests are limited to {max_items} items")
+
+    model = os.getenv("MODEL_NAME", "gpt-4o")
+    items = [(item.user_id, item.message.strip(), item.lang) for item in req.items]
+    if not all(message for _, message, _ in items):
+        raise HTTPException(status_code=400, detail="Empty message")
+    try:
+        job = await submit_batch(items, model=model)
+    except Exception as e:
+        logger.exception("Bulk chat submit error")
+        raise HTTPException(status_code=502, detail="Failed to submit bulk chat")
+    return BulkChatJob(**job)
+
+@app.get("/api/chat/bulk/{batch_id}", response_model=BulkChatJob, dependencies=[Depends(require_admin)])
+async def chat_bulk_status(batch_id: str):
+    """Status of a bulk chat job, with replies once it has completed"""
+    try:
+        job = await get_batch(batch_id)
+    except Exception as e:
+        logger.exception("Bulk chat fetch error")
+        raise HTTPException(status_code=502, detail="Failed to fetch bulk chat")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Bulk chat not found")
+    return BulkChatJob(**job)
+
 @app.post("/api/symptom-assessment")
 def assess_symptom(assessment: SymptomAssessment):
     """Enhanced endpoint for structured symptom assessment"""
     try:
         lang = detect_lang(assessment.symptom)
-        disease_info = get_disease_guidance(assessment.symptom.lower(), lang)
-        suggested_actions = generate_suggested_actions(assessment.symptom.lower(), "low", lang)
+        symptom = assessment.symptom.lower()
+        disease_info = get_disease_guidance(symptom, lang)
+        suggested_actions = generate_suggested_actions(symptom, "low", lang)
         
         # Determine urgency based on severity
         urgency_level = "low"
@@ -103,21 +193,15 @@ def assess_symptom(assessment: SymptomAssessment):
         raise HTTPException(status_code=500, detail="Failed to assess symptom")
 
 @app.get("/api/disease-guidelines/{condition}")
-def get_disease_guidelines(condition: str, lang: str = "en"):
+def get_disease_guidelines(condition: str, request: Request, lang: str = "en"):
     """Get specific disease guidelines"""
-    try:
-        from app.agent import DISEASE_GUIDELINES
-        
-        if condition.lower() in DISEASE_GUIDELINES:
-            guidelines = DISEASE_GUIDELINES[condition.lower()]
-            return {
-                "condition": condition,
-                "guidance": guidelines["guidance"].get(lang, guidelines["guidance"]["en"]),
-                "red_flags": guidelines["red_flags"],
-                "symptoms": guidelines["symptoms"]
-            }
-        else:
-            raise HTTPException(status_code=404, detail="Condition not found")
-    except Exception as e:
-        logger.exception("Guidelines fetch error")
-        raise HTTPException(status_code=500, detail="Failed to fetch guidelines")
+    key = (condition.lower(), lang if lang in LANG_INSTRUCTIONS else "en")
+    body = _GUIDELINE_CACHE.get(key)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Condition not found")
+
+    etag = _GUIDELINE_ETAG[key]
+    if_none_match = {t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")}
+    if "*" in if_none_match or etag in if_none_match:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})